@@ -3,144 +3,313 @@ This is the main Flask backend server. It handles user sessions, serves the web
 Authors: Jai Mangesh Nagle (jnagle)
 """
 
-import random
 import math
 import os
 import logging
+import atexit
 import secrets
-from datetime import datetime, timedelta
+import queue
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
+import numpy as np
+import orjson
 from flask import Flask, jsonify, request, render_template, session, redirect, url_for
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
 
 try:
-    import numpy as np
+    from numba import njit
 except ImportError:
-    np = None
+    njit = None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LOG_DIR = os.path.join(BASE_DIR, '../logs')
 os.makedirs(LOG_DIR, exist_ok=True)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)s | %(message)s'
-)
+LOG_FORMAT = '%(asctime)s | %(levelname)s | %(message)s'
+logging.getLogger().setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
+log_listener = None
+
+def start_log_listener():
+    # Request threads only enqueue records; the listener thread formats and writes them.
+    # Like the schedule pool, gunicorn's post_fork hook restarts this in every worker.
+    global log_listener
+    log_queue = queue.SimpleQueue()
+    formatter = logging.Formatter(LOG_FORMAT)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    file_handler = logging.FileHandler(os.path.join(LOG_DIR, 'stabilizer.log'))
+    file_handler.setFormatter(formatter)
+    # The file is written in batches of up to 512 records, or straight away on an error.
+    memory_handler = MemoryHandler(capacity=512, flushLevel=logging.ERROR, target=file_handler, flushOnClose=True)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+
+    log_listener = QueueListener(log_queue, console_handler, memory_handler, respect_handler_level=True)
+    log_listener.start()
+
+def stop_log_listener():
+    if log_listener is None:
+        return
+    log_listener.stop()
+    for handler in log_listener.handlers:
+        handler.close()
+
+start_log_listener()
+atexit.register(stop_log_listener)
+
+class OrjsonProvider(JSONProvider):
+    # Request bodies and jsonify() both go through orjson; ndarrays are written without a .tolist() copy.
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), mimetype='application/json')
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(32))
-
-active_sessions = {}
+# A full run is two 300-float histories (~15 KB of JSON); Werkzeug answers 413 past this.
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024
+# The float-heavy /init_stabilizer schedule compresses several-fold; tiny JSON replies are left alone.
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 500
+Compress(app)
+
+active_sessions = OrderedDict()
 SESSION_TIMEOUT = 600
 
+# With REDIS_URL set, one-shot session tokens live in Redis under a TTL so every worker
+# shares them and expiry needs no sweep; otherwise they stay in this process's dict.
+REDIS_URL = os.environ.get('REDIS_URL')
+redis_client = None
+if REDIS_URL:
+    import redis
+    redis_client = redis.Redis.from_url(REDIS_URL)
+    app.extensions['redis'] = redis_client
+
 FRAME_COUNT = 300 
 PASS_FRAME_THRESHOLD = FRAME_COUNT - 20 
 MAX_ATTEMPTS = 3 
+MAX_LAG = 25
+FFT_MIN_SAMPLES = 200
+_JOLT_DECAY = np.array([1.0, 0.5, 0.25, 0.125, 0.0625])
+_FRAME_INDEX = np.arange(FRAME_COUNT, dtype=np.float64)
+SCHEDULE_POOL_SIZE = 256
+MAX_HISTORY_LENGTH = 2 * FRAME_COUNT
+
+# Scoring tables: np.digitize maps each metric to bin 0 (below), 1 (human band) or 2 (above).
+# Upper edges sit one ulp above the threshold so the boundary value stays in the human band,
+# matching the strict '>' comparisons these tables replace.
+_ROUGHNESS_BINS = np.array([0.4, np.nextafter(1.2, np.inf)])
+_ROUGHNESS_SCORES = np.array([60, 0, 30])
+_LAG_BINS = np.array([1, 6])
+_LAG_SCORES = np.array([50, 0, 50])
+_SPEED_BINS = np.array([0.2, np.nextafter(1.5, np.inf)])
+_SPEED_SCORES = np.array([40, 0, 40])
+_REASON_TEMPLATES = (
+    ("Mechanical Smoothness (Roughness: {:.2f})", None, "Excessive Input Noise / Artificial Jitter"),
+    ("Predictive/Instant Reaction (Lag: {}f)", None, "High Latency Response (Lag: {}f)"),
+    ("Unnatural Efficiency (Speed: {:.2f})", None, "Erratic/High Speed (Speed: {:.2f})"),
+)
 
 def cleanup_expired_sessions():
-    now = datetime.now()
-    expired = [token for token, data in active_sessions.items() 
-               if now - data.get('created', now) > timedelta(seconds=SESSION_TIMEOUT)]
-    for token in expired:
-        del active_sessions[token]
-
-def lerp(start, end, t):
-    return start + (end - start) * t
+    # Sessions are inserted in creation order, so expired ones are always at the head.
+    now = time.monotonic()
+    while active_sessions:
+        token, data = next(iter(active_sessions.items()))
+        if now - data['created'] <= SESSION_TIMEOUT:
+            break
+        active_sessions.pop(token, None)
+
+def store_session(token, schedule):
+    if redis_client is not None:
+        redis_client.setex(f"sess:{token}", SESSION_TIMEOUT, orjson.dumps(schedule, option=orjson.OPT_SERIALIZE_NUMPY))
+        return
+    cleanup_expired_sessions()
+    active_sessions[token] = {**schedule, 'created': time.monotonic()}
+
+def consume_session(token):
+    # Tokens are single use: a successful lookup also removes the session.
+    if redis_client is not None:
+        return redis_client.getdel(f"sess:{token}") is not None
+    return active_sessions.pop(token, None) is not None
+
+def get_attempts():
+    if redis_client is not None:
+        return int(redis_client.get(f"att:{request.remote_addr}") or 0)
+    return session.get('attempts', 0)
+
+def record_failed_attempt():
+    # With Redis the count is per client address and shared by all workers; it expires
+    # SESSION_TIMEOUT after the last failure instead of resetting on a new cookie.
+    if redis_client is not None:
+        key = f"att:{request.remote_addr}"
+        pipe = redis_client.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, SESSION_TIMEOUT)
+        return pipe.execute()[0]
+    session['attempts'] = session.get('attempts', 0) + 1
+    return session['attempts']
+
+_rng_local = threading.local()
+
+def get_rng():
+    # One Generator per thread (the pool refill thread, plus request threads that generate
+    # inline when the pool is empty) instead of contending on the global random state.
+    rng = getattr(_rng_local, 'rng', None)
+    if rng is None:
+        rng = _rng_local.rng = np.random.default_rng()
+    return rng
 
 def generate_smooth_parameter_schedule(min_val, max_val, frame_count, num_keyframes=5):
-    keyframe_positions = sorted([0] + random.sample(range(1, frame_count - 1), num_keyframes - 2) + [frame_count - 1])
-    keyframe_values = [random.uniform(min_val, max_val) for _ in range(num_keyframes)]
-    schedule = []
-    keyframe_idx = 0
-    for frame in range(frame_count):
-        while keyframe_idx < len(keyframe_positions) - 1 and frame >= keyframe_positions[keyframe_idx + 1]:
-            keyframe_idx += 1
-        if keyframe_idx >= len(keyframe_positions) - 1:
-            schedule.append(keyframe_values[-1])
-        else:
-            start_frame, end_frame = keyframe_positions[keyframe_idx], keyframe_positions[keyframe_idx + 1]
-            t = (frame - start_frame) / (end_frame - start_frame) if end_frame != start_frame else 0
-            schedule.append(lerp(keyframe_values[keyframe_idx], keyframe_values[keyframe_idx + 1], t))
-    return schedule
+    rng = get_rng()
+    interior = np.sort(rng.choice(frame_count - 2, num_keyframes - 2, replace=False) + 1)
+    keyframe_positions = np.concatenate(([0], interior, [frame_count - 1]))
+    # Same formula as np.random.uniform; Generator.uniform rejects min_val > max_val, which 'length' uses.
+    keyframe_values = min_val + (max_val - min_val) * rng.random(num_keyframes)
+    frames = _FRAME_INDEX if frame_count == FRAME_COUNT else np.arange(frame_count, dtype=np.float64)
+    return np.interp(frames, keyframe_positions, keyframe_values)
 
 def generate_force_jolts(frame_count):
-    jolts = [0.0] * frame_count
-    jolt_interval = random.randint(70, 100)
+    rng = get_rng()
+    jolts = np.zeros(frame_count, dtype=np.float32)
+    jolt_interval = int(rng.integers(70, 101))
     for i in range(0, frame_count, jolt_interval):
-        jolt_frame = i + random.randint(0, min(20, frame_count - i - 1))
-        if jolt_frame < frame_count:
-            jolts[jolt_frame] = random.uniform(-0.004, 0.004)
-            for decay in range(1, 5):
-                if jolt_frame + decay < frame_count:
-                    jolts[jolt_frame + decay] = jolts[jolt_frame] * (0.5 ** decay)
+        jolt_frame = i + int(rng.integers(0, min(20, frame_count - i - 1) + 1))
+        end = min(jolt_frame + len(_JOLT_DECAY), frame_count)
+        jolts[jolt_frame:end] = rng.uniform(-0.004, 0.004) * _JOLT_DECAY[:end - jolt_frame]
     return jolts
 
+def generate_chaos_schedule():
+    # Rounded well below anything the physics can show, so each value serializes to a few digits
+    # instead of a full 17-digit float.
+    return {
+        'gravity': np.round(generate_smooth_parameter_schedule(0.10, 0.25, FRAME_COUNT, 10), 4),
+        'length': np.round(generate_smooth_parameter_schedule(120.0, 100.0, FRAME_COUNT, 8), 2),
+        'force_jolts': np.round(generate_force_jolts(FRAME_COUNT), 6),
+    }
 
-def analyze_behavior_pattern(angle_history, cart_history):
-    if not angle_history or len(angle_history) < 20 or not cart_history:
-        return 0, 100, {"error": "insufficient_data"}
-
-    cart_velocity = [cart_history[i] - cart_history[i-1] for i in range(1, len(cart_history))]
+# Schedules don't depend on the request, so a daemon thread keeps a pool of them ready and
+# /init_stabilizer only has to pop one. put() blocks while the pool is full.
+schedule_pool = None
+
+def refill_schedule_pool(pool):
+    while True:
+        pool.put(generate_chaos_schedule())
+
+def start_schedule_pool():
+    # Also called from gunicorn's post_fork hook: the refill thread doesn't survive fork, and the
+    # parent's queue lock may have been held mid-put, so each worker gets a fresh queue.
+    global schedule_pool
+    schedule_pool = queue.Queue(maxsize=SCHEDULE_POOL_SIZE)
+    threading.Thread(target=refill_schedule_pool, args=(schedule_pool,), daemon=True).start()
+
+start_schedule_pool()
+
+
+def _fused_motion_metrics(cart):
+    # Single pass over cart positions: velocity series plus summed |velocity| and |acceleration|.
+    n = cart.shape[0]
+    velocity = np.empty(max(n - 1, 0))
+    total_distance = 0.0
+    total_accel = 0.0
+    for i in range(n - 1):
+        vel = cart[i + 1] - cart[i]
+        velocity[i] = vel
+        total_distance += abs(vel)
+        if i > 0:
+            total_accel += abs(vel - velocity[i - 1])
+    return velocity, total_distance, total_accel
+
+if njit is not None:
+    motion_metrics = njit(cache=True, fastmath=True)(_fused_motion_metrics)
+    motion_metrics(np.zeros(3))  # compile at import so the first verify request doesn't pay for it
+else:
+    def motion_metrics(cart):
+        velocity = np.diff(cart)
+        return velocity, np.abs(velocity).sum(), np.abs(np.diff(velocity)).sum()
+
+
+def _normalize(data):
+    # Center once and reuse that buffer for the variance reduction and the in-place scale.
+    centered = np.asarray(data, dtype=np.float64) - np.mean(data)
+    std = math.sqrt(centered.dot(centered) / centered.size)
+    if std == 0: return centered
+    centered /= std
+    return centered
+
+
+def lag_correlations(angle_sample, vel_sample, max_lag=MAX_LAG):
+    # corr[lag] = sum(angle[i] * vel[i + lag]) / (n - lag). Short samples use the direct sum;
+    # longer ones go through a zero-padded real FFT, which is O(n log n) instead of O(n * max_lag).
+    n = len(angle_sample)
+    if n < FFT_MIN_SAMPLES:
+        raw = np.correlate(vel_sample, angle_sample, mode='full')[n - 1:n - 1 + max_lag]
+    else:
+        nfft = 1 << (2 * n - 2).bit_length()
+        spectrum = np.fft.rfft(angle_sample[::-1], nfft) * np.fft.rfft(vel_sample, nfft)
+        raw = np.fft.irfft(spectrum, nfft)[n - 1:n - 1 + max_lag]
+    return raw / np.arange(n, n - max_lag, -1)
+
+
+def _metric_bins(roughness, lag, speed):
+    return (np.digitize(roughness, _ROUGHNESS_BINS),
+            np.digitize(lag, _LAG_BINS),
+            np.digitize(speed, _SPEED_BINS))
+
+def _score_bins(bins):
+    rough_bin, lag_bin, speed_bin = bins
+    return _ROUGHNESS_SCORES[rough_bin] + _LAG_SCORES[lag_bin] + _SPEED_SCORES[speed_bin]
+
+
+def analyze_behavior_pattern(angles, cart):
+    # Both histories arrive from verify_stability already validated as 1-D float64 arrays.
+    # The handler's final checks read these instead of scanning the history again.
+    extremes = {
+        "max_angle": float(np.abs(angles).max()) if angles.size else 0.0,
+        "final_angle": float(angles[-1]) if angles.size else 0.0
+    }
 
-    cart_accel = [cart_velocity[i] - cart_velocity[i-1] for i in range(1, len(cart_velocity))]
+    if angles.size < 20 or cart.size == 0:
+        return 0, 100, {"error": "insufficient_data", **extremes}
 
+    cart_velocity, total_distance, total_accel = motion_metrics(cart)
 
-    input_roughness = sum(abs(a) for a in cart_accel) / len(cart_accel) if cart_accel else 0
+    input_roughness = total_accel / (cart_velocity.size - 1) if cart_velocity.size > 1 else 0
 
-    best_correlation = -1
     estimated_lag = 0
-    
-    def normalize(data):
-        mean = sum(data) / len(data)
-        std = (sum((x - mean) ** 2 for x in data) / len(data)) ** 0.5
-        if std == 0: return [0] * len(data)
-        return [(x - mean) / std for x in data]
 
-    sample_size = min(len(angle_history), len(cart_velocity)) - 10
+    sample_size = min(angles.size, cart_velocity.size) - 10
     if sample_size > 50:
-        angle_sample = normalize(angle_history[10:10+sample_size])
-        vel_sample = normalize(cart_velocity[10:10+sample_size])
-
-        for lag in range(0, 25):
-            dot_product = 0
-            count = 0
-            for i in range(len(angle_sample) - lag):
-                dot_product += angle_sample[i] * vel_sample[i + lag]
-                count += 1
-            
-            corr = dot_product / count if count > 0 else 0
-            
-            if corr > best_correlation:
-                best_correlation = corr
-                estimated_lag = lag
-
-    total_distance = sum(abs(v) for v in cart_velocity)
-    
-    bot_score = 0
+        angle_sample = _normalize(angles[10:10+sample_size])
+        vel_sample = _normalize(cart_velocity[10:10+sample_size])
+
+        corr = lag_correlations(angle_sample, vel_sample)
+        estimated_lag = int(np.argmax(corr))
+
+    avg_speed = total_distance / cart_velocity.size if cart_velocity.size else 0
+
+    metric_values = (input_roughness, estimated_lag, avg_speed)
+    bins = _metric_bins(*metric_values)
+    bot_score = int(_score_bins(bins))
+
     reasons = []
+    for templates, bin_idx, value in zip(_REASON_TEMPLATES, bins, metric_values):
+        if templates[bin_idx]:
+            reasons.append(templates[bin_idx].format(value))
 
-    if input_roughness < 0.4:
-        bot_score += 60
-        reasons.append(f"Mechanical Smoothness (Roughness: {input_roughness:.2f})")
-    elif input_roughness > 1.2:
-        bot_score += 30
-        reasons.append("Excessive Input Noise / Artificial Jitter")
-
-    if estimated_lag > 5:
-        bot_score += 50
-        reasons.append(f"High Latency Response (Lag: {estimated_lag}f)")
-    elif estimated_lag < 1:
-        bot_score += 50
-        reasons.append(f"Predictive/Instant Reaction (Lag: {estimated_lag}f)")
-
-    avg_speed = total_distance / len(cart_velocity)
-    
-    if avg_speed < 0.2:
-        bot_score += 40
-        reasons.append(f"Unnatural Efficiency (Speed: {avg_speed:.2f})")
-    elif avg_speed > 1.5:
-        bot_score += 40
-        reasons.append(f"Erratic/High Speed (Speed: {avg_speed:.2f})")
-        
     final_ai_prob = min(100, max(0, bot_score))
     final_human_prob = 100 - final_ai_prob
 
@@ -148,76 +317,96 @@ def analyze_behavior_pattern(angle_history, cart_history):
         "input_roughness": round(input_roughness, 3),
         "estimated_lag": estimated_lag,
         "avg_speed": round(avg_speed, 3),
-        "reasons": reasons
+        "reasons": reasons,
+        **extremes
     }
 
     return final_ai_prob, final_human_prob, details
 
 
+_rendered_pages = {}
+
+def render_page(template_name):
+    # The pages take no template context, so each is rendered once and the HTML reused.
+    # Debug mode skips the cache so template edits still show up on reload.
+    html = _rendered_pages.get(template_name)
+    if html is None or app.debug:
+        html = _rendered_pages[template_name] = render_template(template_name)
+    return html
+
+
 @app.route('/')
 def index():
     session.clear()
-    return render_template('login.html')
+    return render_page('login.html')
 
 @app.route('/captcha')
 def captcha():
-    if session.get('attempts', 0) >= MAX_ATTEMPTS:
+    if get_attempts() >= MAX_ATTEMPTS:
         return redirect(url_for('failed_page'))
-    return render_template('captcha.html')
+    return render_page('captcha.html')
 
 @app.route('/success')
 def success_page():
     if not session.get('verified', False):
         return redirect(url_for('index'))
-    return render_template('success.html')
+    return render_page('success.html')
 
 @app.route('/failed')
 def failed_page():
-    return render_template('failed.html')
+    return render_page('failed.html')
 
 @app.route('/init_stabilizer', methods=['GET'])
 def init_stabilizer():
-    cleanup_expired_sessions()
-    
-    if 'attempts' not in session:
-        session['attempts'] = 0
-
-    current_attempts = session.get('attempts', 0)
+    current_attempts = get_attempts()
     if current_attempts >= MAX_ATTEMPTS:
         return jsonify({'success': False, 'error': 'MAX_ATTEMPTS_EXCEEDED', 'redirect': '/failed'})
 
-    gravity = generate_smooth_parameter_schedule(0.10, 0.25, FRAME_COUNT, 10)
-    length = generate_smooth_parameter_schedule(120.0, 100.0, FRAME_COUNT, 8)
-    jolts = generate_force_jolts(FRAME_COUNT)
+    try:
+        schedule = schedule_pool.get_nowait()
+    except queue.Empty:
+        schedule = generate_chaos_schedule()
     token = secrets.token_urlsafe(32)
     
-    active_sessions[token] = {'gravity': gravity, 'length': length, 'force_jolts': jolts, 'created': datetime.now()}
+    store_session(token, schedule)
     
-    return jsonify({
+    payload = {
         'success': True,
         'session_token': token,
         'attempts_left': MAX_ATTEMPTS - current_attempts,
-        'schedule': {'gravity': gravity, 'length': length, 'force_jolts': jolts}
-    })
+        'schedule': schedule
+    }
+    return jsonify(payload)
 
 @app.route('/verify_stability', methods=['POST'])
 def verify_stability():
-    data = request.get_json()
-    if 'attempts' not in session: session['attempts'] = 0
-    
+    data = request.get_json(cache=False)
     if not data or 'session_token' not in data:
         return jsonify({'success': False, 'verified': False}), 400
 
     token = data['session_token']
     angle_history = data.get('angle_history', [])
     cart_history = data.get('cart_history', []) 
+    # Malformed or oversized histories are rejected here, before the session is consumed: each must
+    # be a list of at most MAX_HISTORY_LENGTH finite numbers.
+    histories = []
+    for history in (angle_history, cart_history):
+        if not isinstance(history, list) or len(history) > MAX_HISTORY_LENGTH:
+            return jsonify({'success': False, 'verified': False}), 400
+        try:
+            values = np.asarray(history, dtype=np.float64)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'verified': False}), 400
+        if values.ndim != 1 or not np.isfinite(values).all():
+            return jsonify({'success': False, 'verified': False}), 400
+        histories.append(values)
+    angle_history, cart_history = histories
     
-    if token not in active_sessions:
+    if not consume_session(token):
         return jsonify({'success': False, 'verified': False, 'message': 'Session Expired'}), 403
-    del active_sessions[token]
 
-    if not cart_history:
-        cart_history = [0] * len(angle_history)
+    if cart_history.size == 0:
+        cart_history = np.zeros(angle_history.size)
     
     ai_pct, human_pct, details = analyze_behavior_pattern(angle_history, cart_history)
     
@@ -231,8 +420,7 @@ def verify_stability():
     metrics = {'ai': round(ai_pct, 1), 'human': round(human_pct, 1)}
 
     def fail(msg):
-        session['attempts'] += 1
-        left = MAX_ATTEMPTS - session['attempts']
+        left = MAX_ATTEMPTS - record_failed_attempt()
         
         logger.warning(f"FAILED: {msg} (Attempts left: {left})")
         
@@ -250,14 +438,14 @@ def verify_stability():
         duration_sec = len(angle_history) / 60
         return fail(f'Failed: Lasted {duration_sec:.1f}s / 5.0s')
 
-    if len(angle_history) > 0 and abs(angle_history[-1]) > 1.4:
+    if len(angle_history) > 0 and abs(details['final_angle']) > 1.4:
          return fail('Failed: Reactor crashed at the finish line.')
 
     if ai_pct >= human_pct: 
         return fail('Try again (Likely Bot)')
 
     session['verified'] = True
-    max_angle = max(abs(a) for a in angle_history) if angle_history else 0
+    max_angle = details['max_angle']
     
     logger.info("SUCCESS: User verified as Human.")
 
@@ -275,4 +463,4 @@ def verify_stability():
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG') == '1')
\ No newline at end of file
@@ -8,24 +8,147 @@ import time
 import base64
 import os
 import logging
-from io import BytesIO
+import multiprocessing
+import re
+from collections import OrderedDict, deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from PIL import Image
+from selenium.common.exceptions import WebDriverException
 
 from dotenv import load_dotenv
 load_dotenv()
 
 import google.generativeai as genai
-import json
+import orjson
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
 logger = logging.getLogger("Gemini-Attacker")
 
+# Each Gemini request covers several consecutive frames and returns one move per frame,
+# so the API round trip is paid once per batch instead of once per frame.
+FRAMES_PER_REQUEST = 3
+FRAME_SPACING = 0.1
+# A reply slower than this is useless to a 6-second run; the call falls back to the local rule instead.
+GEMINI_TIMEOUT = 2.0
+# Near vertical the right move is tiny, so the local rule handles it without an API call.
+# Gemini is still consulted at least every DEADBAND_REFRESH_FRAMES frames to keep its plan current.
+DEADBAND_DEG = 3.0
+DEADBAND_REFRESH_FRAMES = 10
+# Two sign flips within this many recent readings mean the local rule is oscillating rather than
+# damping, so Gemini is consulted even inside the deadband.
+OSCILLATION_WINDOW = 4
+LOCAL_GAIN = 2.5
+# Smoothing for the running Gemini latency estimate. A request outstanding for more than twice
+# the estimate is treated as a straggler: the loop acts locally instead of waiting on it.
+LATENCY_EMA_ALPHA = 0.3
+
+# movement_pixels sorts ahead of reasoning in the reply, so the moves can be taken from the stream
+# as soon as the array closes, without waiting for the reasoning tokens. A bare number is accepted
+# too, but only once a delimiter follows it, so a half-streamed "1" of "12" is never read.
+MOVES_RE = re.compile(r'"movement_pixels"\s*:\s*(\[[^\]]*\]|-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?=\s*[,}]))')
+NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?')
+# The outermost object in the reply, ignoring code fences or prose around it.
+JSON_OBJECT_RE = re.compile(r'\{.*\}', re.S)
+
+# The fixed part of the prompt is sent as the system instruction; each request carries only
+# the frame states and recent history.
+SYSTEM_INSTRUCTION = f"""
+You are controlling an inverted pendulum (balancing pole game).
+Each request gives {FRAMES_PER_REQUEST} frames spaced {FRAME_SPACING}s apart, oldest first.
+Goal: Output JSON ONLY → {{ "movement_pixels": [{FRAMES_PER_REQUEST} moves, each -80 to +80, applied {FRAME_SPACING}s apart], "reasoning": "short text" }}
+Do NOT output anything outside the JSON.
+"""
+
+# Structured output: the reply is guaranteed to be this JSON object, so it parses without cleanup.
+DECISION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "movement_pixels": {"type": "array", "items": {"type": "integer"}},
+        "reasoning": {"type": "string"},
+    },
+    "required": ["movement_pixels"],
+}
+
+# The canvas is encoded in the browser, so there is no full-page screenshot to decode and crop.
+# It is first drawn at CAPTURE_WIDTH onto a reused offscreen canvas: the model gains nothing from
+# more pixels, and the smaller JPEG uploads faster. The game paints an opaque background, so there
+# is no alpha to lose.
+CAPTURE_WIDTH = 512
+CAPTURE_QUALITY = 0.6
+ENCODE_CANVAS_JS = f"""
+function encodeCanvas() {{
+  const src = document.getElementById('gameCanvas');
+  const scale = Math.min(1, {CAPTURE_WIDTH} / src.width);
+  const dst = window.__captureCanvas || (window.__captureCanvas = document.createElement('canvas'));
+  const w = Math.round(src.width * scale), h = Math.round(src.height * scale);
+  if (dst.width !== w || dst.height !== h) {{ dst.width = w; dst.height = h; }}
+  dst.getContext('2d').drawImage(src, 0, 0, w, h);
+  return dst.toDataURL('image/jpeg', {CAPTURE_QUALITY}).split(',')[1];
+}}
+"""
+
+# 64-bit difference hash of the canvas as hex: shrink to 9x8, then compare each pixel's luma
+# with its right-hand neighbour. Near-identical scenes hash the same, which keys DECISION_CACHE.
+HASH_CANVAS_JS = """
+function hashCanvas() {
+  const src = document.getElementById('gameCanvas');
+  const dst = window.__hashCanvas || (window.__hashCanvas = Object.assign(document.createElement('canvas'), {width: 9, height: 8}));
+  const ctx = dst.getContext('2d', {willReadFrequently: true});
+  ctx.drawImage(src, 0, 0, 9, 8);
+  const d = ctx.getImageData(0, 0, 9, 8).data;
+  const luma = i => d[i] * 299 + d[i + 1] * 587 + d[i + 2] * 114;
+  let bits = '';
+  for (let y = 0; y < 8; y++) {
+    for (let x = 0; x < 8; x++) {
+      const i = (y * 9 + x) * 4;
+      bits += luma(i) > luma(i + 4) ? '1' : '0';
+    }
+  }
+  return BigInt('0b' + bits).toString(16);
+}
+"""
+DECISION_CACHE_SIZE = 256
+
+# Viewport x of the canvas' left edge and y of its middle row, the reference for CDP mouse moves.
+CANVAS_ORIGIN_JS = """
+const r = document.getElementById('gameCanvas').getBoundingClientRect();
+return [r.left, r.top + r.height / 2];
+"""
+
+# Keeps window.__failed in step with the result overlay, so a frame read checks a flag instead of
+# computing the overlay's style. The observer lives until the page navigates; installing it again is a no-op.
+OVERLAY_WATCH_JS = """
+const overlay = document.getElementById('resultOverlay');
+if (!overlay) return;
+const update = () => { window.__failed = getComputedStyle(overlay).display !== 'none'; };
+if (!window.__overlayObserver) {
+  window.__overlayObserver = new MutationObserver(update);
+  window.__overlayObserver.observe(overlay, {attributes: true, attributeFilter: ['style', 'class']});
+}
+update();
+"""
+
+# Angle, time, overlay visibility and (when arguments[0] is true) the canvas JPEG and its hash in one round trip.
+FRAME_JS = ENCODE_CANVAS_JS + HASH_CANVAS_JS + """
+const angle = parseFloat(document.getElementById('angleDisplay').textContent);
+const time = parseFloat(document.getElementById('timeDisplay').textContent);
+if (!Number.isFinite(angle) || !Number.isFinite(time)) return null;
+return {
+  angle: angle,
+  time: time,
+  overlay: window.__failed === true,
+  image: arguments[0] ? encodeCanvas() : null,
+  hash: arguments[0] ? hashCanvas() : null
+};
+"""
+
 
 class LLMVisionAttacker:
     def __init__(self, url="http://127.0.0.1:3000", api_key=None, headless=False):
@@ -41,12 +164,36 @@ class LLMVisionAttacker:
                 "GEMINI_API_KEY=YOUR_KEY_HERE"
             )
 
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel("gemini-2.5-flash") 
-
-        self.decision_history = []
+        # gRPC keeps one HTTP/2 channel open, so the TLS handshake is paid once rather than per frame.
+        genai.configure(api_key=self.api_key, transport="grpc")
+        self.model = genai.GenerativeModel(
+            "gemini-2.5-flash",
+            generation_config={"response_mime_type": "application/json", "response_schema": DECISION_SCHEMA},
+            system_instruction=SYSTEM_INSTRUCTION,
+        )
+
+        # Only the last few decisions reach the prompt, so they are kept already formatted.
+        self.decision_history = deque(maxlen=3)
+        self._canvas_width = None
+        self._canvas_origin = None
+        self._cursor_x = None
+        self._result_overlay = None
+        self._latency_ema = None
+        # Only the single executor thread reads and writes this, so it needs no lock.
+        self._decision_cache = OrderedDict()
+        # One Gemini request is in flight at a time; it runs here while the next frame is captured.
+        self._pool = ThreadPoolExecutor(max_workers=1)
+
+    def _prewarm_model(self):
+        try:
+            self.model.generate_content(["ping"], request_options={"timeout": 3})
+        except Exception as e:
+            logger.warning(f"Gemini prewarm failed: {e}")
 
     def setup(self):
+        # Opens the gRPC channel and absorbs the model's cold start while Chrome launches.
+        self._pool.submit(self._prewarm_model)
+
         options = webdriver.ChromeOptions()
         if self.headless:
             options.add_argument("--headless=new")
@@ -73,81 +220,77 @@ class LLMVisionAttacker:
         except Exception:
             logger.info("Login skipped")
 
-    def capture_screenshot(self):
+    def read_frame(self, with_image=True):
         try:
-            canvas = self.driver.find_element(By.ID, "gameCanvas")
-            screenshot = self.driver.get_screenshot_as_png()
-            img = Image.open(BytesIO(screenshot))
-
-            loc = canvas.location
-            size = canvas.size
-            dpr = self.driver.execute_script("return window.devicePixelRatio")
-
-            left = loc['x'] * dpr
-            top = loc['y'] * dpr
-            right = left + size['width'] * dpr
-            bottom = top + size['height'] * dpr
-
-            cropped = img.crop((left, top, right, bottom))
-            buf = BytesIO()
-            cropped.save(buf, format="PNG")
-
-            return buf.getvalue()
-
-        except Exception as e:
-            logger.error(f"Screenshot Error: {e}")
+            return self.driver.execute_script(FRAME_JS, with_image)
+        except WebDriverException as e:
+            logger.error(f"Frame Read Error: {e}")
             return None
 
-    def get_game_state(self):
-        try:
-            angle = float(self.driver.find_element(By.ID, "angleDisplay").text.replace("°", ""))
-            t = float(self.driver.find_element(By.ID, "timeDisplay").text.replace("s", ""))
-            return {"angle": angle, "time": t}
-        except:
-            return None
+    def _record_latency(self, submitted, future):
+        latency = time.time() - submitted
+        if self._latency_ema is None:
+            self._latency_ema = latency
+        else:
+            self._latency_ema += LATENCY_EMA_ALPHA * (latency - self._latency_ema)
 
-    def ask_gemini_vision(self, screenshot_bytes, state, history):
-        context = ""
-        if history:
-            last = history[-3:]
-            context = "Recent: " + ", ".join([f"A={h['angle']}→M={h['action']}" for h in last])
+    def ask_gemini_vision(self, screenshot_list, states, history, cache_key=None):
+        if cache_key is not None and cache_key in self._decision_cache:
+            self._decision_cache.move_to_end(cache_key)
+            return self._decision_cache[cache_key]
 
-        prompt = f"""
-You are controlling an inverted pendulum (balancing pole game).
-Current State: Angle: {state['angle']:.1f}°, Time: {state['time']:.1f}s
-Goal: Output JSON ONLY → {{ "movement_pixels": -80 to +80, "reasoning": "short text" }}
-Do NOT output anything outside the JSON.
-{context}
-"""
+        context = "Recent: " + ", ".join(history) if history else ""
+
+        n = len(screenshot_list)
+        frames = "\n".join(f"Frame {i + 1}: Angle: {st['angle']:.1f}°, Time: {st['time']:.1f}s" for i, st in enumerate(states))
+        prompt = f"{frames}\n{context}"
 
         try:
-            image_part = {"mime_type": "image/png", "data": screenshot_bytes}
+            image_parts = [{"mime_type": "image/jpeg", "data": b} for b in screenshot_list]
             response = self.model.generate_content(
-                contents=[prompt, image_part],
+                contents=[prompt] + image_parts,
                 safety_settings={'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_NONE',
                                  'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE',
                                  'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
-                                 'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_NONE'}
+                                 'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_NONE'},
+                request_options={"timeout": GEMINI_TIMEOUT},
+                stream=True
             )
 
-            text_response = response.text.strip().replace("```json", "").replace("```", "")
-            return json.loads(text_response)
+            text = ""
+            for chunk in response:
+                text += chunk.text
+                match = MOVES_RE.search(text)
+                if match:
+                    moves = [int(float(m)) for m in NUMBER_RE.findall(match.group(1))]
+                    return self._remember(cache_key, {"movement_pixels": moves, "reasoning": "(streamed)"})
+
+            match = JSON_OBJECT_RE.search(text)
+            if not match:
+                raise ValueError(f"no JSON object in reply: {text[:80]!r}")
+            return self._remember(cache_key, orjson.loads(match.group(0)))
 
         except Exception as e:
             logger.error(f"Gemini Vision Error: {e}")
-            return {"movement_pixels": int(state['angle'] * 2.5), "reasoning": "Fallback"}
+            return {"movement_pixels": [int(states[-1]['angle'] * LOCAL_GAIN)] * n, "reasoning": "Fallback"}
+
+    def _remember(self, cache_key, decision):
+        if cache_key is not None:
+            self._decision_cache[cache_key] = decision
+            if len(self._decision_cache) > DECISION_CACHE_SIZE:
+                self._decision_cache.popitem(last=False)
+        return decision
 
     def move_mouse(self, new_pos):
-        try:
-            canvas = self.driver.find_element(By.ID, "gameCanvas")
-            width = canvas.size["width"]
-            new_pos = max(0, min(width, new_pos))
+        # One CDP message per move, at viewport coordinates; the right edge is kept inside the canvas
+        # so the game's mousemove listener still receives the event.
+        new_pos = int(max(0, min(self._canvas_width - 1, new_pos)))
+        if new_pos == self._cursor_x:
+            return
 
-            ActionChains(self.driver).move_to_element_with_offset(
-                canvas, new_pos - width/2, 0
-            ).perform()
-        except:
-            pass
+        left, mid_y = self._canvas_origin
+        self.driver.execute_cdp_cmd("Input.dispatchMouseEvent", {"type": "mouseMoved", "x": left + new_pos, "y": mid_y})
+        self._cursor_x = new_pos
 
     def attack(self, max_attempts=3):
         self.setup()
@@ -214,6 +357,7 @@ Do NOT output anything outside the JSON.
         finally:
             logger.info("Attack sequence finished. Quitting driver in 3 seconds...")
             time.sleep(3)
+            self._pool.shutdown(wait=False, cancel_futures=True)
             if self.driver:
                 self.driver.quit()
 
@@ -227,53 +371,112 @@ Do NOT output anything outside the JSON.
             time.sleep(0.1)
             canvas.click()
             logger.info("Game started. Engaging OODA control loop...")
+
+            # Looked up once per attempt; the references stay valid until the page navigates.
+            self._canvas_width = canvas.size["width"]
+            self._canvas_origin = self.driver.execute_script(CANVAS_ORIGIN_JS)
+            # move_to_element above left the cursor at the canvas centre.
+            self._cursor_x = int(self._canvas_width / 2)
+            self._result_overlay = self.driver.find_element(By.ID, "resultOverlay")
+            self.driver.execute_script(OVERLAY_WATCH_JS)
             
             cart_x = 300 
             start = time.time()
-            self.decision_history = [] 
+            self.decision_history.clear()
+            # Frames are captured every FRAME_SPACING seconds while the previous batch's moves are
+            # replayed, and each full batch is sent while the one before it is still in flight.
+            frames = []
+            moves = deque()
+            pending = None
+            pending_state = None
+            pending_submitted = None
+            local_frames = 0
+            recent_angles = deque(maxlen=OSCILLATION_WINDOW)
 
             while time.time() - start < 6.0: 
-                state = self.get_game_state()
-                if not state:
-                    logger.warning("Could not get game state, skipping frame.")
-                    time.sleep(0.1)
-                    continue
+                behind = (pending is not None and not pending.done() and not moves
+                          and self._latency_ema is not None
+                          and time.time() - pending_submitted > 2 * self._latency_ema)
 
-                logger.info(f"OODA: Observe... (t={state['time']:.1f}s)")
-                img_bytes = self.capture_screenshot()
-                if not img_bytes:
-                    logger.warning("Could not capture screenshot, skipping frame.")
+                frame = self.read_frame(with_image=not behind)
+                if not frame:
+                    logger.warning("Could not read game frame, skipping.")
                     time.sleep(0.1)
                     continue
-                
-                logger.info("OODA: Orient & Decide... (Calling Gemini API)")
-                decision = self.ask_gemini_vision(img_bytes, state, self.decision_history)
-                
-                move = int(decision.get("movement_pixels", 0))
-                reason = decision.get("reasoning", "No reasoning.")
-                cart_x += move
-                
 
-                logger.info("OODA: Act! (Moving mouse)")
-                self.move_mouse(cart_x)
-                
-                self.decision_history.append({"angle": state["angle"], "action": move})
-                logger.info(f"==> [t={state['time']:.1f}s] Angle: {state['angle']:>5.1f}° | Gemini: {move:>3}px | Reason: {reason}")
+                if frame["overlay"]:
+                    logger.warning("Game failure detected mid-loop. Breaking.")
+                    break
 
+                state = {"angle": frame["angle"], "time": frame["time"]}
+                logger.info(f"OODA: Observe... (t={state['time']:.1f}s)")
 
-                try:
-                    if self.driver.find_element(By.ID, "resultOverlay").is_displayed():
-                        logger.warning("Game failure detected mid-loop. Breaking.")
-                        break
-                except:
-                    pass 
+                recent_angles.append(state["angle"])
+                flips = sum(a * b < 0 for a, b in zip(recent_angles, islice(recent_angles, 1, None)))
+                near_vertical = abs(state["angle"]) < DEADBAND_DEG and flips < 2
+                if not near_vertical:
+                    # local_frames counts the current run of deadband frames since the last submit.
+                    local_frames = 0
+                in_deadband = near_vertical and local_frames < DEADBAND_REFRESH_FRAMES
+                if in_deadband or behind:
+                    # The prompt promises frames FRAME_SPACING apart, so a batch must not span a skipped frame.
+                    frames.clear()
+                    if in_deadband:
+                        local_frames += 1
+                        # Any queued Gemini moves were planned for a larger error and are now stale.
+                        moves.clear()
+                    move = int(state["angle"] * LOCAL_GAIN)
+                    cart_x += move
+                    self.move_mouse(cart_x)
+                    self.decision_history.append(f"A={state['angle']:.1f}→M={move}")
+                    time.sleep(FRAME_SPACING)
+                    continue
+
+                frames.append((base64.b64decode(frame["image"]), state, frame["hash"]))
+
+                if moves:
+                    move, batch_state = moves.popleft()
+                    cart_x += move
+
+                    logger.info("OODA: Act! (Moving mouse)")
+                    self.move_mouse(cart_x)
+
+                    self.decision_history.append(f"A={batch_state['angle']:.1f}→M={move}")
+
+                if len(frames) == FRAMES_PER_REQUEST:
+                    if pending is not None and not pending.done():
+                        # Still waiting on the previous batch: slide the window rather than block on it.
+                        frames.pop(0)
+                    else:
+                        if pending is not None:
+                            decision, batch_state = pending.result(), pending_state
+                            planned = decision.get("movement_pixels", [])
+                            if not isinstance(planned, list):
+                                planned = [planned]
+                            planned = [int(m) for m in planned[:FRAMES_PER_REQUEST]]
+                            reason = decision.get("reasoning", "No reasoning.")
+                            moves.extend((m, batch_state) for m in planned)
+                            logger.info(f"==> [t={batch_state['time']:.1f}s] Angle: {batch_state['angle']:>5.1f}° | Gemini: {planned}px | Reason: {reason}")
+
+                        logger.info("OODA: Orient & Decide... (Calling Gemini API)")
+                        pending_submitted = time.time()
+                        cache_key = tuple((f[2], round(f[1]["angle"]), round(f[1]["time"] * 2)) for f in frames)
+                        pending = self._pool.submit(self.ask_gemini_vision, [f[0] for f in frames], [f[1] for f in frames], tuple(self.decision_history), cache_key)
+                        pending.add_done_callback(partial(self._record_latency, pending_submitted))
+                        pending_state = state
+                        frames = []
+                        local_frames = 0
+
+                time.sleep(FRAME_SPACING)
+            if pending is not None:
+                pending.cancel()
 
             logger.info("Control loop finished. Waiting for final verification...")
             time.sleep(1) 
 
 
             try:
-                if self.driver.find_element(By.ID, "resultOverlay").is_displayed():
+                if self._result_overlay.is_displayed():
                     logger.info("Failure case: Result overlay is already visible.")
                 else:
                     logger.info("Success case: Clicking 'verifyBtn'...")
@@ -308,10 +511,26 @@ Do NOT output anything outside the JSON.
             return False 
 
 
+def _run_worker(args):
+    # Each process builds its own attacker and WebDriver; neither can be shared across processes.
+    url, max_attempts, headless = args
+    return LLMVisionAttacker(url=url, headless=headless).attack(max_attempts=max_attempts)
+
+
+def run_parallel(url, workers, max_attempts=3, headless=True):
+    with multiprocessing.Pool(processes=workers) as pool:
+        results = pool.map(_run_worker, [(url, max_attempts, headless)] * workers)
+    logger.info(f"Parallel run finished: {sum(results)}/{workers} attackers passed.")
+    return results
+
+
 if __name__ == "__main__":
     import sys
     url = sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:3000"
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
     
-
-    attacker = LLMVisionAttacker(url=url, headless=False)
-    attacker.attack(max_attempts=3)
\ No newline at end of file
+    if workers > 1:
+        run_parallel(url, workers, max_attempts=3)
+    else:
+        attacker = LLMVisionAttacker(url=url, headless=False)
+        attacker.attack(max_attempts=3)
@@ -3,14 +3,21 @@ A script that uses a PID (Proportional-Integral-Derivative) Controller to play t
 Authors: Sai Ruthwik Thummurugoti (thummurs)
 """
 
+import sys
 import time
 import math
 import logging
+import numpy as np
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import WebDriverException
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 
 logging.basicConfig(
@@ -19,40 +26,203 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# The controller works on the displayed angle in degrees, so nothing is converted per frame. The
+# gains and this integral bound are the original per-radian tuning rescaled, which leaves the
+# output unchanged.
+INTEGRAL_LIMIT = math.degrees(2.0)
+
+
+def _pid_step(error, previous_error, integral, kp, ki, kd, dt):
+    if error * previous_error < 0:
+        integral = 0.0
+
+    p_term = kp * error
+
+    integral += error * dt
+    integral = max(-INTEGRAL_LIMIT, min(INTEGRAL_LIMIT, integral))
+    i_term = ki * integral
+
+    derivative = (error - previous_error) / dt if dt > 0 else 0.0
+    d_term = kd * derivative
+
+    return p_term + i_term + d_term, integral, error
+
+if njit is not None:
+    # With an explicit signature numba compiles eagerly at import (so the first game frame doesn't pay
+    # for it) and casts int arguments instead of compiling another specialisation.
+    _pid_step = njit("UniTuple(float64, 3)(float64, float64, float64, float64, float64, float64, float64)",
+                     cache=True)(_pid_step)
+
+
+# Installed once per page: whenever the game rewrites either display, the parsed
+# [angle_deg, elapsed] pair is published on window.__pidState, so a frame read is a single
+# property fetch. parseFloat drops the unit suffix; a display that isn't a number yet gives null.
+STATE_WATCH_JS = """
+if (window.__pidObserver) return;
+const ang = document.getElementById('angleDisplay');
+const tim = document.getElementById('timeDisplay');
+const publish = () => {
+  const angle = parseFloat(ang.textContent);
+  const elapsed = parseFloat(tim.textContent);
+  window.__pidState = Number.isFinite(angle) && Number.isFinite(elapsed) ? [angle, elapsed] : null;
+};
+window.__pidObserver = new MutationObserver(publish);
+for (const el of [ang, tim]) {
+  window.__pidObserver.observe(el, {childList: true, characterData: true, subtree: true});
+}
+publish();
+"""
+STATE_JS = "return window.__pidState || null;"
+
+# window.__mm(target, smoothing) eases the cart position towards canvas-relative target, keeps it
+# on the canvas, moves the cursor there along the middle row with a synthetic mousemove (the game
+# reads clientX - rect.left) and returns the new position. The position starts at the centre on
+# every install. The rect is measured once: the page doesn't scroll or resize during a game, and
+# re-measuring would force a layout each frame while the displays are being rewritten.
+MOUSE_HELPER_JS = """
+const canvas = document.getElementById('gameCanvas');
+const rect = canvas.getBoundingClientRect();
+let cart = rect.width / 2;
+window.__mm = (target, smoothing = 0.5) => {
+  cart = Math.max(0, Math.min(rect.width, cart + (target - cart) * smoothing));
+  canvas.dispatchEvent(new MouseEvent('mousemove', {
+    clientX: rect.left + cart, clientY: rect.top + rect.height / 2, bubbles: true
+  }));
+  return cart;
+};
+"""
+MOVE_JS = "return window.__mm(arguments[0], arguments[1]);"
+
+# Waits in the page for the verdict to be written into #resultTitle (the element is always present,
+# empty until the server answers) and resolves with its text, or null after RESULT_TIMEOUT seconds.
+RESULT_TIMEOUT = 5
+RESULT_POLL_JS = """
+const [timeout, done] = arguments;
+const deadline = performance.now() + timeout * 1000;
+(function poll() {
+  const title = document.getElementById('resultTitle');
+  const text = title ? title.innerText.trim() : '';
+  if (text || performance.now() > deadline) {
+    done(text || null);
+    return;
+  }
+  setTimeout(poll, 16);
+})();
+"""
+
+LOOP_DURATION = 5.5
+CONTROL_PERIOD = 1 / 60
+MAX_OUTPUT = 150
+DANGER_ZONE_DEG = 25.0
+
+# The whole control loop as one execute_async_script call: each animation frame reads
+# window.__pidState, runs the same PID step and emergency rule as run_pid_loop, and hands the
+# target to window.__mm. Resolves with the per-frame telemetry
+# once LOOP_DURATION passes.
+BROWSER_PID_JS = """
+const [kp, ki, kd, integralLimit, maxOutput, dangerZone, duration, done] = arguments;
+const width = document.getElementById('gameCanvas').getBoundingClientRect().width;
+const center = width / 2;
+let prevError = 0, integral = 0;
+// Timed on the rAF clock from the first frame: a frame timestamp can precede performance.now()
+// taken when this script started, which would give a negative first dt and elapsed.
+let start = null, last = null;
+const telemetry = [];
+
+function step(now) {
+  if (start === null) start = last = now;
+  const state = window.__pidState;
+  const elapsed = (now - start) / 1000;
+  if (!state || elapsed > duration) {
+    done({elapsed: elapsed, telemetry: telemetry});
+    return;
+  }
+  const rawDt = (now - last) / 1000;
+  const dt = rawDt > 0 ? rawDt : 1 / 60;
+  last = now;
+
+  const error = state[0];
+  let control;
+  if (Math.abs(error) > dangerZone) {
+    control = error > 0 ? -maxOutput : maxOutput;
+  } else {
+    if (error * prevError < 0) integral = 0;
+    integral = Math.max(-integralLimit, Math.min(integralLimit, integral + error * dt));
+    control = kp * error + ki * integral + kd * (error - prevError) / dt;
+    control = Math.max(-maxOutput, Math.min(maxOutput, control));
+    prevError = error;
+  }
+
+  const target = Math.max(30, Math.min(width - 30, center + control));
+  const cart = window.__mm(target);
+
+  telemetry.push([elapsed, state[0], control, cart]);
+  requestAnimationFrame(step);
+}
+requestAnimationFrame(step);
+"""
+
 
 class PIDController:
-    def __init__(self, kp=80, ki=0.02, kd=35):
-        self.kp = kp
-        self.ki = ki
-        self.kd = kd
+    def __init__(self, kp=math.radians(80), ki=math.radians(0.02), kd=math.radians(35)):
+        self.kp = float(kp)
+        self.ki = float(ki)
+        self.kd = float(kd)
         self.previous_error = 0.0
         self.integral = 0.0
 
     def update(self, error, dt=1/60):
-        if error * self.previous_error < 0:
-            self.integral = 0.0
+        output, self.integral, self.previous_error = _pid_step(
+            error, self.previous_error, self.integral, self.kp, self.ki, self.kd, dt
+        )
+        return output
+
+    def update_batch(self, errors, dt=1/60):
+        """Vectorised update() over a recorded error trace, for offline gain sweeps.
+
+        Gives the same outputs and final state as calling update() once per
+        element. The integral only needs a Python step per run of same-signed
+        errors: inside a run it moves one way, so clipping the running sum
+        once is the same as clipping it every step.
+        """
+        errors = np.asarray(errors, dtype=float)
+        if errors.size == 0:
+            return errors
+
+        prev = np.concatenate(([self.previous_error], errors[:-1]))
+        reset = errors * prev < 0
+        steps = errors * dt
 
-        p_term = self.kp * error
+        sign = np.sign(errors)
+        nonzero = np.flatnonzero(sign)
+        flips = nonzero[1:][sign[nonzero[1:]] != sign[nonzero[:-1]]]
+        edges = np.concatenate(([0], flips, [errors.size]))
 
-        self.integral += error * dt
-        self.integral = max(-2.0, min(2.0, self.integral))
-        i_term = self.ki * self.integral
+        integral = np.empty_like(errors)
+        acc = self.integral
+        for a, b in zip(edges[:-1], edges[1:]):
+            start = 0.0 if reset[a] else acc
+            integral[a:b] = np.clip(start + np.cumsum(steps[a:b]), -INTEGRAL_LIMIT, INTEGRAL_LIMIT)
+            acc = integral[b - 1]
 
-        derivative = (error - self.previous_error) / dt if dt > 0 else 0.0
-        d_term = self.kd * derivative
+        derivative = np.diff(errors, prepend=self.previous_error) / dt if dt > 0 else np.zeros_like(errors)
 
-        self.previous_error = error
+        self.previous_error = float(errors[-1])
+        self.integral = float(acc)
 
-        return p_term + i_term + d_term
+        return self.kp * errors + self.ki * integral + self.kd * derivative
 
 
 class PIDAttacker:
-    def __init__(self):
+    def __init__(self, in_browser=True, headless=True):
         self.url = "http://127.0.0.1:3000"
-        self.headless = False
+        self.headless = headless
+        # Run the control loop inside the page (one WebDriver call per attempt) rather than from Python.
+        self.in_browser = in_browser
         self.driver = None
         self.pid = PIDController()
         self.current_mouse_x = None
+        self._canvas_width = None
 
     def setup(self):
         options = webdriver.ChromeOptions()
@@ -62,6 +232,18 @@ class PIDAttacker:
         if self.headless:
             options.add_argument("--headless=new")
 
+        # Nothing but the game page runs during an attack, so the browser is kept from spending
+        # CPU on GPU setup, extensions, background fetches and translate prompts, and from
+        # throttling the page if its window loses focus.
+        options.add_argument("--disable-gpu")
+        options.add_argument("--disable-extensions")
+        options.add_argument("--disable-background-networking")
+        options.add_argument("--disable-renderer-backgrounding")
+        options.add_argument("--disable-features=TranslateUI,BackForwardCache")
+        options.add_argument("--no-sandbox")
+        # Every page step below waits for its own element, so navigation needn't wait for subresources.
+        options.page_load_strategy = "eager"
+
         self.driver = webdriver.Chrome(options=options)
         self.driver.get(self.url)
 
@@ -100,6 +282,12 @@ class PIDAttacker:
 
             canvas = self.driver.find_element(By.ID, "gameCanvas")
             canvas.click()
+
+            # Looked up once per game; the page reloads between attempts, so this is refreshed here.
+            self._canvas_width = canvas.size["width"]
+            self.driver.execute_script(STATE_WATCH_JS)
+            self.driver.execute_script(MOUSE_HELPER_JS)
+
             time.sleep(0.3)
             return True
 
@@ -109,40 +297,22 @@ class PIDAttacker:
 
     def get_state(self):
         try:
-            angle_text = self.driver.find_element(By.ID, "angleDisplay").text
-            angle_deg = float(angle_text.replace("°", ""))
-
-            time_text = self.driver.find_element(By.ID, "timeDisplay").text
-            elapsed = float(time_text.replace("s", ""))
-
-            return {
-                "angle": math.radians(angle_deg),
-                "angle_deg": angle_deg,
-                "time": elapsed
-            }
-        except:
+            reading = self.driver.execute_script(STATE_JS)
+        except WebDriverException:
             return None
+        if reading is None:
+            return None
+
+        angle_deg, elapsed = reading
+        return {
+            "angle_deg": angle_deg,
+            "time": elapsed
+        }
 
     def move_mouse(self, target_x, smoothing=0.5):
         try:
-            canvas = self.driver.find_element(By.ID, "gameCanvas")
-            width = canvas.size["width"]
-
-            if self.current_mouse_x is None:
-                self.current_mouse_x = width / 2
-
-            smooth_x = self.current_mouse_x + (target_x - self.current_mouse_x) * smoothing
-            smooth_x = max(0, min(width, smooth_x))
-
-            ActionChains(self.driver).move_to_element_with_offset(
-                canvas,
-                smooth_x - width / 2,
-                0
-            ).perform()
-
-            self.current_mouse_x = smooth_x
-
-        except:
+            self.current_mouse_x = self.driver.execute_script(MOVE_JS, target_x, smoothing)
+        except WebDriverException:
             pass
 
     def verify(self):
@@ -155,9 +325,22 @@ class PIDAttacker:
             self.driver.execute_script("arguments[0].click();", verify_btn)
             logger.info("VERIFY button clicked successfully")
 
-            result = WebDriverWait(self.driver, 5).until(
-                EC.presence_of_element_located((By.ID, "resultTitle"))
-            ).text
+            self.driver.set_script_timeout(RESULT_TIMEOUT + 5)
+            try:
+                result = self.driver.execute_async_script(RESULT_POLL_JS, RESULT_TIMEOUT)
+            except WebDriverException:
+                # A pass navigates straight to /success, unloading the page under the poll.
+                result = None
+            if result is None:
+                try:
+                    WebDriverWait(self.driver, 3).until(lambda d: "/captcha" not in d.current_url)
+                except WebDriverException:
+                    pass
+                if "/success" in self.driver.current_url:
+                    logger.info(" SUCCESS PAGE REACHED!")
+                    return True
+                logger.error(f"No verification result within {RESULT_TIMEOUT}s")
+                return False
 
             logger.info(f"Verification result: {result}")
 
@@ -166,16 +349,18 @@ class PIDAttacker:
                 
                 time.sleep(2)
                 
-                if "/captcha" in self.driver.current_url:
+                url = self.driver.current_url
+                if "/captcha" in url:
                     logger.info("No automatic redirect detected, forcing navigation...")
                     self.driver.get(self.url + "/success")
                     time.sleep(1)
+                    url = self.driver.current_url
                 
-                if "/success" in self.driver.current_url:
+                if "/success" in url:
                     logger.info(" SUCCESS PAGE REACHED!")
                     return True
                 else:
-                    logger.warning(f"Unexpected URL: {self.driver.current_url}")
+                    logger.warning(f"Unexpected URL: {url}")
                     return False
             else:
                 logger.info("✗ Verification failed")
@@ -195,54 +380,69 @@ class PIDAttacker:
         else:
             return "CONTINUE"
 
+    def _log_telemetry(self, telemetry):
+        # Written out after the loop, never from inside it; one row per 0.1 s window each second.
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        for elapsed, angle_deg, control, cart in telemetry:
+            if int(elapsed * 10) % 10 == 0:
+                logger.info("[t=%.1fs] [ANGLE=%+6.2f°] [PID=%+6.2f] [CART=%.1f]", elapsed, angle_deg, control, cart)
+
     def run_pid_loop(self):
-        canvas = self.driver.find_element(By.ID, "gameCanvas")
-        width = canvas.size["width"]
+        width = self._canvas_width
         center_x = width / 2
         self.current_mouse_x = center_x
 
-        start_time = time.time()
-        last_loop = start_time
+        # Fixed-step schedule on the monotonic clock: each tick sleeps until its own deadline, so the
+        # WebDriver time inside a tick doesn't push later ticks back, and the PID sees a constant dt.
+        start_time = time.perf_counter()
+        telemetry = []
 
-        MAX_OUTPUT = 150
-        DANGER_ZONE = math.radians(25)
-
-        while True:
+        for tick in range(int(LOOP_DURATION / CONTROL_PERIOD) + 1):
             state = self.get_state()
             if not state:
                 break
 
-            now = time.time()
-            dt = now - last_loop
-            last_loop = now
-
-            elapsed = now - start_time
-            
-            if elapsed > 5.5:
-                logger.info(f"Stabilization complete after {elapsed:.2f}s")
+            elapsed = time.perf_counter() - start_time
+            if elapsed > LOOP_DURATION:
                 break
 
-            angle = state["angle"]
             angle_deg = state["angle_deg"]
 
-            if abs(angle) > DANGER_ZONE:
-                control = -MAX_OUTPUT if angle > 0 else MAX_OUTPUT
+            if abs(angle_deg) > DANGER_ZONE_DEG:
+                control = -MAX_OUTPUT if angle_deg > 0 else MAX_OUTPUT
             else:
-                control = self.pid.update(angle, dt if dt > 0 else 1/60)
+                control = self.pid.update(angle_deg, CONTROL_PERIOD)
                 control = max(-MAX_OUTPUT, min(MAX_OUTPUT, control))
 
             target = center_x + control
             target = max(30, min(width - 30, target))
 
             self.move_mouse(target)
+            telemetry.append((elapsed, angle_deg, control, self.current_mouse_x))
 
-            if int(elapsed * 10) % 10 == 0: 
-                logger.info(
-                    f"[t={elapsed:.1f}s] [ANGLE={angle_deg:+6.2f}°] "
-                    f"[PID={control:+6.2f}] [CART={self.current_mouse_x:.1f}]"
-                )
+            sleep_for = start_time + (tick + 1) * CONTROL_PERIOD - time.perf_counter()
+            if sleep_for > 0:
+                time.sleep(sleep_for)
+
+        self._log_telemetry(telemetry)
+        logger.info(f"Stabilization complete after {time.perf_counter() - start_time:.2f}s")
+        time.sleep(0.5)
 
-            time.sleep(1/60)
+    def run_browser_loop(self):
+        self.driver.set_script_timeout(LOOP_DURATION + 5)
+        try:
+            result = self.driver.execute_async_script(
+                BROWSER_PID_JS, self.pid.kp, self.pid.ki, self.pid.kd, INTEGRAL_LIMIT,
+                MAX_OUTPUT, DANGER_ZONE_DEG, LOOP_DURATION
+            )
+        except WebDriverException as e:
+            logger.error(f"In-browser PID loop failed: {e}")
+            return
+
+        self._log_telemetry(result["telemetry"])
+        self.current_mouse_x = result["telemetry"][-1][3] if result["telemetry"] else None
+        logger.info(f"Stabilization complete after {result['elapsed']:.2f}s")
 
         time.sleep(0.5)
 
@@ -262,19 +462,21 @@ class PIDAttacker:
                 logger.error("Could not start game")
                 return False
 
-            self.run_pid_loop()
+            if self.in_browser:
+                self.run_browser_loop()
+            else:
+                self.run_pid_loop()
 
-            verified = self.verify()
-            
-            if verified:
-                status = self.check_redirect()
-                
-                if status == "SUCCESS":
-                    logger.info(" ATTACK SUCCESSFUL - CAPTCHA DEFEATED!")
-                    time.sleep(3) 
-                    return True
+            if self.verify():
+                logger.info(" ATTACK SUCCESSFUL - CAPTCHA DEFEATED!")
+                time.sleep(3) 
+                return True
 
             status = self.check_redirect()
+            if status == "SUCCESS":
+                logger.info(" ATTACK SUCCESSFUL - CAPTCHA DEFEATED!")
+                time.sleep(3)
+                return True
             if status == "FAILED":
                 logger.info("Maximum attempts exceeded → FAILED PAGE")
                 return False
@@ -293,7 +495,7 @@ class PIDAttacker:
 
 
 if __name__ == "__main__":
-    attacker = PIDAttacker()
+    attacker = PIDAttacker(in_browser="--python-loop" not in sys.argv, headless="--headed" not in sys.argv)
     try:
         success = attacker.attack()
         exit(0 if success else 1)
@@ -8,13 +8,16 @@ import math
 import pickle
 import os
 import sys
-from collections import defaultdict
+from bisect import bisect_right
+
+import numpy as np
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import WebDriverException
 
 
 class QLearningAgent:
@@ -23,53 +26,68 @@ class QLearningAgent:
         self.gamma = discount
         self.epsilon = epsilon
 
-        self.q_table = defaultdict(lambda: defaultdict(float))
         self.actions = [-40, -20, 0, 20, 40]
+        self.action_index = {a: i for i, a in enumerate(self.actions)}
 
-    def discretize_state(self, angle, angular_velocity):
-        import numpy as np
+        # Bin edges are built once; bisect_right on a list matches np.digitize for scalar input.
+        self.angle_bins = np.linspace(-1.4, 1.4, 10).tolist()
+        self.vel_bins = np.linspace(-0.6, 0.6, 6).tolist()
 
-        angle_bins = np.linspace(-1.4, 1.4, 10)
-        vel_bins = np.linspace(-0.6, 0.6, 6)
+        # States are small bin indices, so Q-values live in a dense (angle, velocity, action) array.
+        self.q_table = np.zeros((len(self.angle_bins) + 1, len(self.vel_bins) + 1, len(self.actions)))
 
-        angle_idx = int(np.digitize(angle, angle_bins))
-        vel_idx = int(np.digitize(angular_velocity, vel_bins))
+    def discretize_state(self, angle, angular_velocity):
+        angle_idx = bisect_right(self.angle_bins, angle)
+        vel_idx = bisect_right(self.vel_bins, angular_velocity)
 
         return (angle_idx, vel_idx)
 
     def get_action(self, state, explore=True):
-        import numpy as np
-
         if explore and np.random.random() < self.epsilon:
             return np.random.choice(self.actions)
 
-        q_values = [self.q_table[state][a] for a in self.actions]
-        max_q = max(q_values)
-        best_actions = [a for a, q in zip(self.actions, q_values) if q == max_q]
+        q_values = self.q_table[state]
+        best_actions = np.flatnonzero(q_values == q_values.max())
 
-        return int(np.random.choice(best_actions))
+        return self.actions[np.random.choice(best_actions)]
 
     def update(self, state, action, reward, next_state):
-        max_next = max(self.q_table[next_state][a] for a in self.actions)
-        current = self.q_table[state][action]
+        max_next = self.q_table[next_state].max()
+        idx = state + (self.action_index[action],)
+        current = self.q_table[idx]
 
         new_q = current + self.lr * (reward + self.gamma * max_next - current)
-        self.q_table[state][action] = new_q
+        self.q_table[idx] = new_q
 
-    def save(self, filename="q_table.pkl"):
-        with open(filename, "wb") as f:
-            pickle.dump(dict(self.q_table), f)
+    def save(self, filename="q_table.npz"):
+        np.savez_compressed(filename, q_table=self.q_table)
 
-    def load(self, filename="q_table.pkl"):
+    def load(self, filename="q_table.npz", legacy_filename="q_table.pkl"):
         if os.path.exists(filename):
-            with open(filename, "rb") as f:
+            with np.load(filename) as data:
+                self.q_table = data["q_table"]
+            return True
+        if os.path.exists(legacy_filename):
+            # Older tables were pickled as {state: {action: q}} dicts.
+            with open(legacy_filename, "rb") as f:
                 data = pickle.load(f)
-            self.q_table = defaultdict(lambda: defaultdict(float), data)
+            for state, action_values in data.items():
+                for action, q in action_values.items():
+                    self.q_table[tuple(state) + (self.action_index[action],)] = q
             return True
         return False
 
 
 
+# Reads both HUD values in one WebDriver round trip instead of two find_element + .text calls.
+# parseFloat stops at the unit suffix; a display that isn't a number yet comes back as null.
+GAME_STATE_JS = (
+    "const angle = parseFloat(document.getElementById('angleDisplay').textContent);"
+    "const time = parseFloat(document.getElementById('timeDisplay').textContent);"
+    "return Number.isFinite(angle) && Number.isFinite(time) ? [angle, time] : null;"
+)
+
+
 class RLAttacker:
     def __init__(self, url="http://127.0.0.1:3000", train_episodes=20, headless=False):
         self.url = url
@@ -80,6 +98,8 @@ class RLAttacker:
 
         self.previous_angle = 0.0
         self.current_mouse_x = None
+        self.canvas = None
+        self.canvas_width = None
 
 
     def _create_driver(self):
@@ -131,37 +151,37 @@ class RLAttacker:
                 return "LOGIN"
             else:
                 return "UNKNOWN"
-        except:
+        except WebDriverException:
             return "ERROR"
 
 
     def get_game_state(self):
         try:
-            angle_deg = float(
-                self.driver.find_element(By.ID, "angleDisplay").text.replace("°", "")
-            )
-            time_val = float(
-                self.driver.find_element(By.ID, "timeDisplay").text.replace("s", "")
-            )
-
-            angle_rad = math.radians(angle_deg)
-            angular_velocity = (angle_rad - self.previous_angle) * 60
-            self.previous_angle = angle_rad
-
-            return {
-                "angle": angle_rad,
-                "velocity": angular_velocity,
-                "time": time_val,
-            }
-
-        except:
+            reading = self.driver.execute_script(GAME_STATE_JS)
+        except WebDriverException:
+            return None
+        if reading is None:
             return None
 
+        angle_deg, time_val = reading
+        angle_rad = math.radians(angle_deg)
+        angular_velocity = (angle_rad - self.previous_angle) * 60
+        self.previous_angle = angle_rad
+
+        return {
+            "angle": angle_rad,
+            "velocity": angular_velocity,
+            "time": time_val,
+        }
+
 
     def move_mouse_smoothly(self, target_x):
         try:
-            canvas = self.driver.find_element(By.ID, "gameCanvas")
-            width = canvas.size["width"]
+            if self.canvas is None:
+                self.canvas = self.driver.find_element(By.ID, "gameCanvas")
+                self.canvas_width = self.canvas.size["width"]
+            canvas = self.canvas
+            width = self.canvas_width
 
             if self.current_mouse_x is None:
                 self.current_mouse_x = width / 2
@@ -174,7 +194,7 @@ class RLAttacker:
 
             self.current_mouse_x = target_x
 
-        except:
+        except WebDriverException:
             pass
 
 
@@ -201,7 +221,7 @@ class RLAttacker:
 
         try:
             ActionChains(self.driver).move_to_element(canvas).click().perform()
-        except:
+        except WebDriverException:
             canvas.click()
 
         time.sleep(0.2)
@@ -210,6 +230,10 @@ class RLAttacker:
         width = canvas.size["width"]
         cart_x = width / 2
 
+        # The page reloads between episodes, so the cached canvas is refreshed here.
+        self.canvas = canvas
+        self.canvas_width = width
+
         episode_reward = 0
         steps = 0
         timestep = 1 / 60
@@ -405,7 +429,7 @@ class RLAttacker:
                     retry_btn.click()
                     print("TRY AGAIN button clicked")
                     time.sleep(1.5)
-                except:
+                except WebDriverException:
                     print("No retry button found, reloading captcha...")
                     try:
                         self.driver.get(self.url + "/captcha")
@@ -4,8 +4,7 @@ This Python script automates the solving of visual-semantic CAPTCHAs
 
 Authors: Sai Ruthwik Thummurugoti (thummurs), Sainath Bingi (bingis) and Aniket Mishra (mishraa1)
 """
-import time, io, re, os
-from PIL import Image
+import time, base64, re, os
 import google.generativeai as genai
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -34,9 +33,9 @@ def setup_driver():
     return driver
 
 def capture_screenshot(driver):
-    """Capture full page screenshot as PIL Image."""
-    png = driver.get_screenshot_as_png()
-    return Image.open(io.BytesIO(png))
+    """Capture full page screenshot as an inline JPEG part for Gemini."""
+    shot = driver.execute_cdp_cmd("Page.captureScreenshot", {"format": "jpeg", "quality": 85})
+    return {"mime_type": "image/jpeg", "data": base64.b64decode(shot["data"])}
 
 def semantic_validator(answer_text, driver):
     """Check Gemini output against CAPTCHA rules before submission."""
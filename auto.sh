@@ -81,7 +81,7 @@ setup_environment
 start_server_bg
 
 echo -e "\n${GREEN}=== 1. Running PID Attacker (Mechanical Bot) ===${NC}"
-python attackers/attacker_pid.py
+python attackers/attacker_pid.py --headed
 echo -e "${BLUE}[*] PID Attack complete.${NC}"
 sleep 2
 
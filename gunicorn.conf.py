@@ -0,0 +1,20 @@
+"""
+Gunicorn settings for the stabilizer backend. Used by: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 3000)}"
+
+# Without REDIS_URL, active_sessions lives in process memory and a token issued by one worker is
+# unknown to the others. Scale with threads by default; raise WEB_CONCURRENCY only with Redis configured.
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = True
+
+
+def post_fork(server, worker):
+    from app import start_log_listener, start_schedule_pool
+    start_log_listener()
+    start_schedule_pool()
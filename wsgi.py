@@ -0,0 +1,6 @@
+"""
+WSGI entry point for serving the stabilizer with a production server instead of the Werkzeug development server.
+Run with: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from app import app